@@ -1,10 +1,31 @@
 # Copyright (c) 2024, Zinye Technologies and contributors
 # For license information, please see license.txt
 
+import re
+
 import frappe
 from frappe import _
-from frappe.utils import getdate, today, flt, cint
 from frappe.model.document import Document
+from frappe.utils import add_months, cint, flt, get_quarter_start, getdate, now, today
+from frappe.utils.caching import request_cache
+from frappe.utils.html_utils import sanitize_html
+
+PERFORMANCE_SUMMARY_CACHE_KEY = "prm:partner_performance_summary"
+PERFORMANCE_SUMMARY_CACHE_TTL = 60 * 60
+
+PARTNER_SEARCH_INDEX = "ft_partner_search"
+PARTNER_SEARCH_INDEX_CACHE_KEY = "prm:has_partner_search_index"
+PARTNER_SEARCH_FIELDS = "partner_name, email, partner_code, primary_contact"
+# InnoDB's default innodb_ft_min_token_size; shorter words are not indexed
+FULLTEXT_MIN_WORD_LENGTH = 3
+# InnoDB's default FULLTEXT stopwords; they are not indexed, so requiring
+# one (e.g. "com" from an email address) would match nothing
+FULLTEXT_STOPWORDS = frozenset({
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for",
+    "from", "how", "i", "in", "is", "it", "la", "of", "on", "or", "that", "the",
+    "this", "to", "was", "what", "when", "where", "who", "will", "with", "und", "www"
+})
+FULLTEXT_CANDIDATE_LIMIT = 1000
 
 
 @frappe.whitelist()
@@ -23,6 +44,7 @@ def get_partner_list(filters=None, limit=20, start=0, search_term=None):
     """
     if not filters:
         filters = {}
+    limit, start = cint(limit), cint(start)
 
     # Build search conditions
     conditions = []
@@ -48,8 +70,16 @@ def get_partner_list(filters=None, limit=20, start=0, search_term=None):
         order_by="partner_score desc, modified desc"
     )
 
-    # Get total count for pagination
-    total_count = frappe.db.count("CRM Partner", filters)
+    # A short page already tells us the total; only count when there may be
+    # more rows beyond it, through the same permission checks as the page
+    if (partners and len(partners) < limit) or (not partners and not start):
+        total_count = start + len(partners)
+    else:
+        total_count = frappe.get_list(
+            "CRM Partner",
+            filters=filters,
+            fields=["count(`tabCRM Partner`.name) as total_count"]
+        )[0].total_count
 
     return {
         "partners": partners,
@@ -101,6 +131,8 @@ def create_partner(partner_data):
     Returns:
         dict: Created partner record
     """
+    # Undo only this call's writes on failure, not the caller's transaction
+    frappe.db.savepoint("create_partner")
     try:
         # Validate required fields
         required_fields = ["partner_name", "partner_type", "partner_tier", "email"]
@@ -115,7 +147,6 @@ def create_partner(partner_data):
         })
 
         partner.insert()
-        frappe.db.commit()
 
         return {
             "success": True,
@@ -124,7 +155,7 @@ def create_partner(partner_data):
         }
 
     except Exception as e:
-        frappe.db.rollback()
+        frappe.db.rollback(save_point="create_partner")
         frappe.throw(_("Failed to create partner: {0}").format(str(e)))
 
 
@@ -140,6 +171,7 @@ def update_partner(partner_name, partner_data):
     Returns:
         dict: Updated partner record
     """
+    frappe.db.savepoint("update_partner")
     try:
         partner = frappe.get_doc("CRM Partner", partner_name)
 
@@ -153,7 +185,6 @@ def update_partner(partner_name, partner_data):
                 setattr(partner, field, value)
 
         partner.save()
-        frappe.db.commit()
 
         return {
             "success": True,
@@ -164,7 +195,7 @@ def update_partner(partner_name, partner_data):
     except frappe.DoesNotExistError:
         frappe.throw(_("Partner not found"))
     except Exception as e:
-        frappe.db.rollback()
+        frappe.db.rollback(save_point="update_partner")
         frappe.throw(_("Failed to update partner: {0}").format(str(e)))
 
 
@@ -173,16 +204,31 @@ def get_partner_performance_summary(partner_name):
     """
     Get performance summary for a partner.
 
+    Results are memoized for the rest of the request and cached in redis
+    for an hour; saving the partner clears the cached entry.
+
     Args:
         partner_name (str): Name of the partner document
 
     Returns:
         dict: Performance metrics and trends
     """
-    # Monthly performance for the last 12 months
-    from frappe.utils import add_months
+    return _get_partner_performance_summary(partner_name, today())
+
+
+@request_cache
+def _get_partner_performance_summary(partner_name, end_date):
+    cache_key = f"{PERFORMANCE_SUMMARY_CACHE_KEY}:{partner_name}:{end_date}"
+    summary = frappe.cache.get_value(cache_key)
+    if summary is None:
+        summary = _build_partner_performance_summary(partner_name, end_date)
+        frappe.cache.set_value(cache_key, summary, expires_in_sec=PERFORMANCE_SUMMARY_CACHE_TTL)
 
-    end_date = today()
+    return summary
+
+
+def _build_partner_performance_summary(partner_name, end_date):
+    # Monthly performance for the last 12 months
     start_date = add_months(end_date, -12)
 
     # Get monthly deal closures
@@ -212,15 +258,14 @@ def get_partner_performance_summary(partner_name):
         ORDER BY month
     """, (partner_name, start_date, end_date), as_dict=True)
 
-    # Current quarter performance
-    current_quarter_start = frappe.utils.get_quarter_start(today())
-    current_quarter_deals = frappe.db.sql("""
-        SELECT COUNT(*) as deals, SUM(deal_value) as revenue
-        FROM `tabCRM Deal`
-        WHERE partner = %s
-            AND status = 'Won'
-            AND closed_date >= %s
-    """, (partner_name, current_quarter_start), as_dict=True)[0]
+    # Current quarter performance, derived from the monthly rows since the
+    # quarter always falls inside the 12 month window
+    current_quarter_month = getdate(get_quarter_start(end_date)).strftime("%Y-%m")
+    quarter_months = [row for row in monthly_deals if row.month >= current_quarter_month]
+    current_quarter_deals = {
+        "deals": sum(cint(row.deals_count) for row in quarter_months),
+        "revenue": sum(flt(row.revenue) for row in quarter_months)
+    }
 
     return {
         "monthly_trends": {
@@ -232,6 +277,11 @@ def get_partner_performance_summary(partner_name):
     }
 
 
+def clear_partner_performance_cache(partner_name):
+    """Drop cached performance summaries for a partner"""
+    frappe.cache.delete_keys(f"{PERFORMANCE_SUMMARY_CACHE_KEY}:{partner_name}:")
+
+
 @frappe.whitelist()
 def get_partner_recent_deals(partner_name, limit=10):
     """Get recent deals for a partner"""
@@ -275,6 +325,7 @@ def assign_lead_to_partner(lead_name, partner_name, reason=None):
     Returns:
         dict: Assignment result
     """
+    frappe.db.savepoint("assign_lead_to_partner")
     try:
         # Get and validate lead
         lead = frappe.get_doc("CRM Lead", lead_name)
@@ -291,19 +342,8 @@ def assign_lead_to_partner(lead_name, partner_name, reason=None):
         lead.lead_owner = partner.assigned_partner_manager or frappe.session.user
         lead.save()
 
-        # Create activity log
-        frappe.get_doc({
-            "doctype": "CRM Activity",
-            "activity_type": "Lead Assignment",
-            "subject": f"Lead assigned to partner {partner.partner_name}",
-            "description": reason or f"Lead {lead.lead_name} assigned to partner {partner.partner_name}",
-            "reference_doctype": "CRM Lead",
-            "reference_name": lead_name,
-            "assigned_to": partner.assigned_partner_manager,
-            "status": "Completed"
-        }).insert()
-
-        frappe.db.commit()
+        # One plain INSERT; the timeline comment needs no controller hooks
+        insert_partner_activities([get_lead_assignment_activity(lead_name, lead.lead_name, partner, reason)])
 
         return {
             "success": True,
@@ -313,10 +353,119 @@ def assign_lead_to_partner(lead_name, partner_name, reason=None):
         }
 
     except Exception as e:
-        frappe.db.rollback()
+        frappe.db.rollback(save_point="assign_lead_to_partner")
         frappe.throw(_("Failed to assign lead to partner: {0}").format(str(e)))
 
 
+@frappe.whitelist()
+def assign_leads_to_partner(lead_names, partner_name, reason=None):
+    """
+    Assign several leads to a partner in one go.
+
+    Leads are updated with a single UPDATE, bypassing lead hooks, and the
+    activity log rows are written with one bulk insert.
+
+    Args:
+        lead_names (list): Names of the lead documents
+        partner_name (str): Name of the partner document
+        reason (str): Reason for assignment
+
+    Returns:
+        dict: Assignment result
+    """
+    from prm.fprm.doctype.crm_partner.crm_partner import flag_partner_metrics_stale
+
+    lead_names = list(set(frappe.parse_json(lead_names) or []))
+    if not lead_names:
+        frappe.throw(_("No leads to assign"))
+
+    frappe.db.savepoint("assign_leads_to_partner")
+    try:
+        leads = frappe.get_list(
+            "CRM Lead",
+            filters={"name": ["in", lead_names]},
+            fields=["name", "lead_name", "partner"]
+        )
+        if len(leads) != len(lead_names):
+            frappe.throw(_("Not permitted to assign these leads"))
+
+        # Same per-lead check as assign_lead_to_partner; reading a lead is not enough
+        for lead in leads:
+            frappe.has_permission("CRM Lead", "write", doc=lead.name, throw=True)
+
+        partner = frappe.get_doc("CRM Partner", partner_name)
+        if partner.status != "Active":
+            frappe.throw(_("Cannot assign lead to inactive partner"))
+
+        lead_owner = partner.assigned_partner_manager or frappe.session.user
+        frappe.db.sql("""
+            UPDATE `tabCRM Lead`
+            SET partner = %s, lead_owner = %s, modified = %s, modified_by = %s
+            WHERE name IN %s
+        """, (partner_name, lead_owner, now(), frappe.session.user, tuple(lead_names)))
+
+        insert_partner_activities([
+            get_lead_assignment_activity(lead.name, lead.lead_name, partner, reason)
+            for lead in leads
+        ])
+
+        # Lead hooks were bypassed, so flag metrics of every affected partner
+        for affected_partner in {partner_name, *(lead.partner for lead in leads if lead.partner)}:
+            flag_partner_metrics_stale(affected_partner)
+
+        return {
+            "success": True,
+            "message": _("{0} leads assigned to partner successfully").format(len(leads)),
+            "partner": partner.partner_name
+        }
+
+    except Exception as e:
+        frappe.db.rollback(save_point="assign_leads_to_partner")
+        frappe.throw(_("Failed to assign leads to partner: {0}").format(str(e)))
+
+
+# Comment columns of a lead assignment activity
+ACTIVITY_COMMENT_FIELDS = ("comment_type", "reference_doctype", "reference_name", "content")
+
+
+def get_lead_assignment_activity(lead_name, lead_title, partner, reason=None):
+    """Build the Info comment logged on a lead's timeline for a partner assignment"""
+    return {
+        "comment_type": "Info",
+        "reference_doctype": "CRM Lead",
+        "reference_name": lead_name,
+        "content": reason or f"Lead {lead_title} assigned to partner {partner.partner_name}"
+    }
+
+
+def insert_partner_activities(activities):
+    """
+    Write timeline Comment rows with a single multi-row INSERT.
+
+    The insert skips Comment.validate, so the content is sanitized here.
+    """
+    if not activities:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    values = [
+        (
+            frappe.generate_hash(length=10), user, timestamp, timestamp, user, user,
+            *(
+                sanitize_html(activity[field], always_sanitize=True) if field == "content" else activity[field]
+                for field in ACTIVITY_COMMENT_FIELDS
+            )
+        )
+        for activity in activities
+    ]
+
+    frappe.db.bulk_insert("Comment",
+        fields=("name", "owner", "creation", "modified", "modified_by", "comment_email", *ACTIVITY_COMMENT_FIELDS),
+        values=values
+    )
+
+
 @frappe.whitelist()
 def get_partner_territories():
     """Get list of territories with partner counts"""
@@ -358,13 +507,26 @@ def partner_dashboard_stats():
     """Get overall partner dashboard statistics"""
     stats = {}
 
-    # Total partners by status
-    stats["partners_by_status"] = frappe.db.sql("""
-        SELECT status, COUNT(*) as count
+    # Status and onboarding breakdowns come from a single scan of the
+    # partner table, folded into both groupings here
+    status_counts = frappe.db.sql("""
+        SELECT status, onboarding_status, COUNT(*) as count
         FROM `tabCRM Partner`
-        GROUP BY status
+        GROUP BY status, onboarding_status
     """, as_dict=True)
 
+    partners_by_status = {}
+    onboarding_status = {}
+    for row in status_counts:
+        partners_by_status[row.status] = partners_by_status.get(row.status, 0) + row.count
+        if row.status == "Active":
+            onboarding_status[row.onboarding_status] = row.count
+
+    # Total partners by status
+    stats["partners_by_status"] = [
+        frappe._dict(status=status, count=count) for status, count in partners_by_status.items()
+    ]
+
     # Top performing partners this month
     current_month = frappe.utils.get_first_day_of_week(today())
     stats["top_partners_this_month"] = frappe.db.sql("""
@@ -384,12 +546,9 @@ def partner_dashboard_stats():
     """, (current_month,), as_dict=True)
 
     # Partner onboarding status
-    stats["onboarding_status"] = frappe.db.sql("""
-        SELECT onboarding_status, COUNT(*) as count
-        FROM `tabCRM Partner`
-        WHERE status = 'Active'
-        GROUP BY onboarding_status
-    """, as_dict=True)
+    stats["onboarding_status"] = [
+        frappe._dict(onboarding_status=status, count=count) for status, count in onboarding_status.items()
+    ]
 
     return stats
 
@@ -416,9 +575,12 @@ def search_partners(search_term, partner_type=None, territory=None, limit=10):
     if territory:
         filters["territory"] = territory
 
-    # Search in multiple fields
+    # Search in multiple fields, through the FULLTEXT index when available
     or_filters = []
-    if search_term:
+    matches = get_fulltext_partner_matches(search_term, partner_type, territory) if search_term else None
+    if matches:
+        filters["name"] = ["in", matches]
+    elif search_term:
         or_filters = [
             ["partner_name", "like", f"%{search_term}%"],
             ["email", "like", f"%{search_term}%"],
@@ -438,4 +600,71 @@ def search_partners(search_term, partner_type=None, territory=None, limit=10):
         order_by="partner_score desc"
     )
 
-    return partners
\ No newline at end of file
+    return partners
+
+
+def get_fulltext_partner_matches(search_term, partner_type=None, territory=None):
+    """
+    Resolve a search term to matching partner names via the FULLTEXT index.
+
+    Every word of the term is matched as a prefix. The search filters and
+    ordering are applied in the same query, so the candidate limit keeps the
+    best scoring matches. Returns None when the index cannot serve the term
+    (other database, index missing, or only stopwords and words shorter than
+    the minimum token size) or finds nothing, so callers fall back to LIKE.
+    """
+    if frappe.db.db_type != "mariadb":
+        return None
+
+    words = [
+        word for word in re.findall(r"\w+", search_term)
+        if len(word) >= FULLTEXT_MIN_WORD_LENGTH and word.lower() not in FULLTEXT_STOPWORDS
+    ]
+    if not words or not has_partner_search_index():
+        return None
+
+    conditions = [
+        f"MATCH({PARTNER_SEARCH_FIELDS}) AGAINST (%(term)s IN BOOLEAN MODE)",
+        "status != 'Terminated'"
+    ]
+    if partner_type:
+        conditions.append("partner_type = %(partner_type)s")
+    if territory:
+        conditions.append("territory = %(territory)s")
+
+    matches = frappe.db.sql_list(f"""
+        SELECT name
+        FROM `tabCRM Partner`
+        WHERE {" AND ".join(conditions)}
+        ORDER BY partner_score DESC
+        LIMIT %(limit)s
+    """, {
+        "term": " ".join(f"+{word}*" for word in words),
+        "partner_type": partner_type,
+        "territory": territory,
+        "limit": FULLTEXT_CANDIDATE_LIMIT
+    })
+
+    # Tokenization can differ from LIKE's substring match; let LIKE have a go
+    return matches or None
+
+
+def has_partner_search_index():
+    """Whether the FULLTEXT search index exists; cached until the next cache clear"""
+    return frappe.cache.get_value(
+        PARTNER_SEARCH_INDEX_CACHE_KEY,
+        generator=lambda: bool(frappe.db.has_index("tabCRM Partner", PARTNER_SEARCH_INDEX))
+    )
+
+
+def add_partner_search_index():
+    """Create the FULLTEXT index search_partners uses, on MariaDB only"""
+    # search_partners falls back to LIKE on other databases
+    if frappe.db.db_type != "mariadb":
+        return
+
+    if not frappe.db.has_index("tabCRM Partner", PARTNER_SEARCH_INDEX):
+        frappe.db.sql_ddl(
+            f"ALTER TABLE `tabCRM Partner` ADD FULLTEXT INDEX `{PARTNER_SEARCH_INDEX}` ({PARTNER_SEARCH_FIELDS})"
+        )
+    frappe.cache.delete_value(PARTNER_SEARCH_INDEX_CACHE_KEY)
@@ -254,6 +254,12 @@ class CRMDeal(Document):
 		}
 
 
+def on_doctype_update():
+	# partner is not part of the base schema; index it on sites that have it
+	if frappe.db.has_column("CRM Deal", "partner"):
+		frappe.db.add_index("CRM Deal", ["partner", "status", "closed_date"], "partner_status_closed_date_index")
+
+
 @frappe.whitelist()
 def add_contact(deal, contact):
 	if not frappe.has_permission("CRM Deal", "write", deal):
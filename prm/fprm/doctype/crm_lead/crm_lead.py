@@ -400,6 +400,13 @@ class CRMLead(Document):
 		}
 
 
+def on_doctype_update():
+	# partner is not part of the base schema; index it on sites that have it
+	if frappe.db.has_column("CRM Lead", "partner"):
+		frappe.db.add_index("CRM Lead", ["partner", "status"], "partner_status_index")
+		frappe.db.add_index("CRM Lead", ["partner", "creation"], "partner_creation_index")
+
+
 @frappe.whitelist()
 def convert_to_deal(lead, doc=None, deal=None, existing_contact=None, existing_organization=None):
 	if not (doc and doc.flags.get("ignore_permissions")) and not frappe.has_permission(
@@ -1,11 +1,15 @@
 # Copyright (c) 2024, Zinye Technologies and contributors
 # For license information, please see license.txt
 
+import json
+
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import getdate, today, flt, cint
-from datetime import datetime, timedelta
+from frappe.utils import add_days, getdate, today, flt, cint, now, sbool, get_fullname
+
+from prm.api.partner import add_partner_search_index, clear_partner_performance_cache
+from prm.permissions.partner_permissions import clear_partner_user_cache
 
 
 class CRMPartner(Document):
@@ -21,40 +25,51 @@ class CRMPartner(Document):
 
     def validate(self):
         """Validate partner data before saving"""
-        self.validate_partner_code()
         self.validate_agreement_dates()
         self.validate_commission_and_discount()
         self.set_partner_code_if_empty()
-        self.validate_email_uniqueness()
 
     def before_save(self):
         """Execute before saving the document"""
-        self.calculate_performance_metrics()
-        self.update_partner_score()
-        self.set_onboarding_status()
+        current_date = getdate()
+
+        # Metrics only depend on linked deals and leads, whose hooks flag the
+        # partner as stale; plain edits skip the aggregate queries
+        if self.is_new():
+            # Nothing can link to a partner that is still being created
+            self.reset_performance_metrics()
+        elif self.metrics_stale:
+            self.calculate_performance_metrics(current_date)
+            self.metrics_stale = 0
+        self.update_partner_score(current_date)
+        self.set_onboarding_status(current_date)
 
     def after_insert(self):
         """Execute after inserting new partner"""
-        self.create_partner_user()
-        self.send_welcome_notification()
+        # User creation and the welcome email are not needed for the response
+        if not self.flags.skip_user_creation:
+            frappe.enqueue(
+                provision_partner_account,
+                queue="short",
+                enqueue_after_commit=True,
+                now=frappe.flags.in_test,
+                partner=self.name
+            )
         self.create_onboarding_tasks()
 
     def on_update(self):
         """Execute when partner is updated"""
         self.sync_partner_permissions()
+        clear_partner_performance_cache(self.name)
+        if self.has_value_changed('email'):
+            doc_before_save = self.get_doc_before_save()
+            clear_partner_user_cache(self.email, doc_before_save and doc_before_save.email)
         if self.has_value_changed('status'):
             self.handle_status_change()
 
-    def validate_partner_code(self):
-        """Validate partner code format and uniqueness"""
-        if self.partner_code:
-            # Check if partner code already exists
-            existing = frappe.db.exists("CRM Partner", {
-                "partner_code": self.partner_code,
-                "name": ["!=", self.name]
-            })
-            if existing:
-                frappe.throw(_("Partner Code {0} already exists").format(self.partner_code))
+    def on_trash(self):
+        """Execute when partner is deleted"""
+        clear_partner_user_cache(self.email)
 
     def validate_agreement_dates(self):
         """Validate agreement start and end dates"""
@@ -77,81 +92,103 @@ class CRMPartner(Document):
             code_base = "".join([c.upper() for c in self.partner_name.split() if c])[:6]
             type_code = self.partner_type[:3].upper() if self.partner_type else "GEN"
 
-            counter = 1
-            while True:
-                proposed_code = f"{code_base}{type_code}{counter:03d}"
-                if not frappe.db.exists("CRM Partner", {"partner_code": proposed_code}):
-                    self.partner_code = proposed_code
-                    break
-                counter += 1
+            prefix = f"{code_base}{type_code}"
+
+            # Continue from the highest counter already issued for this prefix;
+            # the unique index on partner_code catches concurrent inserts
+            last_counter = frappe.db.sql("""
+                SELECT MAX(CAST(SUBSTRING(partner_code, %s) AS UNSIGNED))
+                FROM `tabCRM Partner`
+                WHERE partner_code LIKE %s
+            """, (len(prefix) + 1, f"{prefix}%"))[0][0]
+
+            self.partner_code = f"{prefix}{cint(last_counter) + 1:03d}"
+
+    def show_unique_validation_message(self, e):
+        """
+        Partner code and email uniqueness are enforced by unique keys rather
+        than pre-insert lookups; map their violations to friendly messages.
+        """
+        # The violated key is named last; the duplicate value may mention either field
+        key = str(e).rsplit("key", 1)[-1]
+        if "email" in key:
+            frappe.throw(
+                _("Email {0} is already registered with another partner").format(self.email),
+                frappe.UniqueValidationError
+            )
+        if "partner_code" in key:
+            frappe.throw(
+                _("Partner Code {0} already exists").format(self.partner_code),
+                frappe.UniqueValidationError
+            )
 
-    def validate_email_uniqueness(self):
-        """Ensure email is unique across partners"""
-        if self.email:
-            existing = frappe.db.exists("CRM Partner", {
-                "email": self.email,
-                "name": ["!=", self.name]
-            })
-            if existing:
-                frappe.throw(_("Email {0} is already registered with another partner").format(self.email))
+        super().show_unique_validation_message(e)
 
-    def calculate_performance_metrics(self):
+    def calculate_performance_metrics(self, current_date=None):
         """Calculate and update performance metrics"""
-        # Get deals closed by this partner
-        deals = frappe.get_all("CRM Deal",
-            filters={
-                "partner": self.name,
-                "status": "Won"
-            },
-            fields=["deal_value", "closed_date"]
-        )
-
-        if deals:
-            self.total_deals_closed = len(deals)
-            self.total_revenue_generated = sum([flt(deal.deal_value) for deal in deals])
+        current_date = current_date or getdate()
+
+        # Aggregate won deals in the database instead of pulling every row
+        deal_stats = frappe.db.sql("""
+            SELECT
+                COUNT(*) as deals_count,
+                COALESCE(SUM(deal_value), 0) as revenue,
+                MAX(closed_date) as last_deal_date,
+                COALESCE(SUM(CASE WHEN YEAR(closed_date) = %s THEN deal_value END), 0) as ytd_revenue
+            FROM `tabCRM Deal`
+            WHERE partner = %s
+                AND status = 'Won'
+        """, (current_date.year, self.name), as_dict=True)[0]
+
+        if deal_stats.deals_count:
+            self.total_deals_closed = deal_stats.deals_count
+            self.total_revenue_generated = flt(deal_stats.revenue)
             self.average_deal_size = self.total_revenue_generated / self.total_deals_closed
-
-            # Get latest deal date
-            latest_deal = max(deals, key=lambda x: x.closed_date) if deals else None
-            if latest_deal:
-                self.last_deal_date = latest_deal.closed_date
-
-            # Calculate YTD revenue
-            current_year = datetime.now().year
-            ytd_deals = [deal for deal in deals if getdate(deal.closed_date).year == current_year]
-            self.ytd_revenue = sum([flt(deal.deal_value) for deal in ytd_deals])
+            self.last_deal_date = deal_stats.last_deal_date
+            self.ytd_revenue = flt(deal_stats.ytd_revenue)
         else:
-            self.total_deals_closed = 0
-            self.total_revenue_generated = 0
-            self.average_deal_size = 0
-            self.ytd_revenue = 0
+            self.reset_performance_metrics(include_leads=False)
 
         # Calculate lead conversion rate
-        total_leads = frappe.db.count("CRM Lead", {"partner": self.name})
-        converted_leads = frappe.db.count("CRM Lead", {
-            "partner": self.name,
-            "status": "Converted"
-        })
-
-        if total_leads > 0:
-            self.lead_conversion_rate = (converted_leads / total_leads) * 100
+        lead_stats = frappe.db.sql("""
+            SELECT
+                COUNT(*) as total_leads,
+                COALESCE(SUM(CASE WHEN status = 'Converted' THEN 1 ELSE 0 END), 0) as converted_leads
+            FROM `tabCRM Lead`
+            WHERE partner = %s
+        """, (self.name,), as_dict=True)[0]
+
+        if lead_stats.total_leads > 0:
+            self.lead_conversion_rate = (flt(lead_stats.converted_leads) / lead_stats.total_leads) * 100
         else:
             self.lead_conversion_rate = 0
 
-    def update_partner_score(self):
+    def reset_performance_metrics(self, include_leads=True):
+        """Zero the metrics of a partner without won deals (or leads)"""
+        self.total_deals_closed = 0
+        self.total_revenue_generated = 0
+        self.average_deal_size = 0
+        self.ytd_revenue = 0
+        if include_leads:
+            self.lead_conversion_rate = 0
+
+    def update_partner_score(self, current_date=None):
         """Calculate overall partner score based on multiple factors"""
+        current_date = current_date or getdate()
+
         score = 0
 
-        # Revenue performance (40% of score)
+        # Revenue performance (40% of score); negative values score nothing,
+        # as in refresh_partner_scores
         if self.total_revenue_generated:
             # Normalize revenue to 40 points (assuming 1M = 40 points)
-            revenue_score = min(40, (self.total_revenue_generated / 1000000) * 40)
+            revenue_score = min(40, (max(0, flt(self.total_revenue_generated)) / 1000000) * 40)
             score += revenue_score
 
         # Conversion rate performance (30% of score)
         if self.lead_conversion_rate:
             # Normalize conversion rate to 30 points
-            conversion_score = min(30, (self.lead_conversion_rate / 100) * 30)
+            conversion_score = min(30, (max(0, flt(self.lead_conversion_rate)) / 100) * 30)
             score += conversion_score
 
         # Training and certification (20% of score)
@@ -166,21 +203,23 @@ class CRMPartner(Document):
         compliance_score = 0
         if self.status == "Active":
             compliance_score += 5
-        if self.agreement_end_date and getdate(self.agreement_end_date) > getdate(today()):
+        if self.agreement_end_date and getdate(self.agreement_end_date) > current_date:
             compliance_score += 5
         score += compliance_score
 
         self.partner_score = min(100, int(score))
 
-    def set_onboarding_status(self):
+    def set_onboarding_status(self, current_date=None):
         """Update onboarding status based on completion criteria"""
+        current_date = current_date or getdate()
+
         if (self.training_completed and
             self.certification_obtained and
             self.portal_access_enabled and
             self.onboarding_status != "Completed"):
 
             self.onboarding_status = "Completed"
-            self.onboarding_completion_date = today()
+            self.onboarding_completion_date = current_date.isoformat()
 
     def create_partner_user(self):
         """Create user account for partner portal access"""
@@ -238,21 +277,35 @@ class CRMPartner(Document):
             }
         ]
 
-        for task in tasks:
-            todo = frappe.get_doc({
-                "doctype": "ToDo",
-                "subject": task["subject"],
-                "description": task["description"],
-                "priority": task["priority"],
-                "reference_type": "CRM Partner",
-                "reference_name": self.name,
-                "assigned_by": frappe.session.user
-            })
+        # The rows are written in one multi-row INSERT instead of a document
+        # insert per task; ToDo has no subject column, the description
+        # carries the task text.
+        timestamp = now()
+        user = frappe.session.user
+        fields = [
+            "name", "owner", "creation", "modified", "modified_by", "status",
+            "description", "priority", "reference_type", "reference_name",
+            "assigned_by", "allocated_to"
+        ]
+        values = [
+            (
+                frappe.generate_hash(length=10), user, timestamp, timestamp, user, "Open",
+                task["description"], task["priority"], "CRM Partner", self.name,
+                user, self.assigned_partner_manager
+            )
+            for task in tasks
+        ]
 
-            if self.assigned_partner_manager:
-                todo.allocated_to = self.assigned_partner_manager
+        frappe.db.bulk_insert("ToDo", fields=fields, values=values)
 
-            todo.insert(ignore_permissions=True)
+        # The insert skips ToDo.on_update; do its reference update and
+        # timeline comments for the partner manager here
+        if self.assigned_partner_manager:
+            self.db_set("_assign", json.dumps([self.assigned_partner_manager]), update_modified=False)
+            for task in tasks:
+                self.add_comment("Assigned", _("{0} assigned {1}: {2}").format(
+                    get_fullname(user), get_fullname(self.assigned_partner_manager), task["description"]
+                ))
 
     def sync_partner_permissions(self):
         """Sync partner permissions based on tier and status"""
@@ -270,17 +323,17 @@ class CRMPartner(Document):
 
     def enable_partner_access(self):
         """Enable partner portal access"""
-        if self.email:
-            user = frappe.get_doc("User", self.email)
-            user.enabled = 1
-            user.save(ignore_permissions=True)
+        self.set_partner_user_enabled(1)
 
     def disable_partner_access(self):
         """Disable partner portal access"""
+        self.set_partner_user_enabled(0)
+
+    def set_partner_user_enabled(self, enabled):
+        """Flip the partner user's enabled bit without a full User save"""
         if self.email:
-            user = frappe.get_doc("User", self.email)
-            user.enabled = 0
-            user.save(ignore_permissions=True)
+            frappe.db.set_value("User", self.email, "enabled", enabled)
+            frappe.clear_cache(user=self.email)
 
     @frappe.whitelist()
     def get_partner_dashboard_data(self):
@@ -301,34 +354,167 @@ class CRMPartner(Document):
             "recent_activity": self.get_recent_activity()
         }
 
-    def get_recent_activity(self):
-        """Get recent partner activity"""
+    def get_recent_activity(self, fields=None, pluck=None):
+        """Get recent partner activity; pass pluck to get a flat list of one field"""
         # This would return recent leads, deals, tasks, etc.
         return frappe.get_all("CRM Deal",
             filters={"partner": self.name},
-            fields=["name", "organization", "deal_value", "status", "modified"],
+            fields=fields or ["name", "organization", "deal_value", "status", "modified"],
+            pluck=pluck,
             order_by="modified desc",
             limit=5
         )
 
 
+def on_doctype_update():
+    """Create the indexes schema sync does not manage"""
+    add_partner_search_index()
+
+
 # Utility functions for partner management
 
+PARTNER_BY_EMAIL_FIELDS = ("name", "partner_name", "partner_tier", "status")
+
+
 @frappe.whitelist()
-def get_partner_by_email(email):
-    """Get partner record by email"""
-    return frappe.db.get_value("CRM Partner", {"email": email}, "*", as_dict=True)
+def get_partner_by_email(email, fields=None):
+    """Get partner record by email, fetching only the requested fields of PARTNER_BY_EMAIL_FIELDS"""
+    fields = frappe.parse_json(fields) if fields else PARTNER_BY_EMAIL_FIELDS
+    if not set(fields).issubset(PARTNER_BY_EMAIL_FIELDS):
+        frappe.throw(_("Only {0} can be requested").format(", ".join(PARTNER_BY_EMAIL_FIELDS)))
+
+    return frappe.db.get_value("CRM Partner", {"email": email}, list(fields), as_dict=True)
+
+
+# Deal and lead fields the partner metrics are computed from
+PARTNER_METRIC_SOURCE_FIELDS = ("partner", "status", "deal_value", "closed_date")
+
+# Columns written by recalculate_partner_metrics
+PARTNER_METRIC_FIELDS = (
+    "total_deals_closed", "total_revenue_generated", "average_deal_size",
+    "last_deal_date", "ytd_revenue", "lead_conversion_rate", "partner_score"
+)
+
+
+def mark_partner_metrics_stale(doc, method=None):
+    """Flag the partner(s) linked to a deal or lead for metric recalculation"""
+    doc_before_save = doc.get_doc_before_save()
+    if (
+        method == "on_update"
+        and doc_before_save
+        and not any(doc.has_value_changed(field) for field in PARTNER_METRIC_SOURCE_FIELDS)
+    ):
+        # Notes, owner and other edits cannot change the partner's metrics
+        return
+
+    partners = {doc.get("partner")}
+    if doc_before_save:
+        # Lead/deal moved to another partner; both need fresh metrics
+        partners.add(doc_before_save.get("partner"))
+
+    for partner in filter(None, partners):
+        flag_partner_metrics_stale(partner)
+
+
+def flag_partner_metrics_stale(partner):
+    """Mark partner metrics stale and queue their recalculation"""
+    # An already stale partner has its recalculation pending; spare the busy row a write
+    if not frappe.db.get_value("CRM Partner", partner, "metrics_stale"):
+        frappe.db.set_value("CRM Partner", partner, "metrics_stale", 1, update_modified=False)
+    frappe.enqueue(
+        recalculate_partner_metrics,
+        queue="short",
+        job_id=f"prm:recalculate_partner_metrics:{partner}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        partner=partner
+    )
+
+
+def recalculate_partner_metrics(partner, max_passes=3):
+    """
+    Background job: refresh performance metrics of a stale partner.
+
+    The flag is cleared and committed before the aggregates are read, so a
+    deal or lead change landing mid-run sets it again instead of being lost
+    to the deduplicated enqueue; such a change gets another pass. Only the
+    metric columns are written, leaving concurrent edits to the partner alone.
+    """
+    for _pass in range(max_passes):
+        if not frappe.db.get_value("CRM Partner", partner, "metrics_stale"):
+            break
+
+        frappe.db.set_value("CRM Partner", partner, "metrics_stale", 0, update_modified=False)
+        frappe.db.commit()
+
+        partner_doc = frappe.get_doc("CRM Partner", partner)
+        partner_doc.calculate_performance_metrics()
+        partner_doc.update_partner_score()
+        frappe.db.set_value("CRM Partner", partner,
+            {field: partner_doc.get(field) for field in PARTNER_METRIC_FIELDS},
+            update_modified=False
+        )
+        frappe.db.commit()
+        clear_partner_performance_cache(partner)
+
+
+def provision_partner_account(partner):
+    """Background job: create the portal user and send the welcome email"""
+    partner_doc = frappe.get_doc("CRM Partner", partner)
+    partner_doc.create_partner_user()
+    partner_doc.send_welcome_notification()
+
+
+def refresh_partner_scores(current_date=None):
+    """
+    Daily job: recompute partner_score for all partners in one UPDATE.
+
+    Mirrors CRMPartner.update_partner_score, including its application-side
+    date, so scores also follow agreements expiring, which no save would
+    otherwise pick up. Partners still flagged
+    stale, e.g. because a change landed as their job was finishing, are
+    recalculated first.
+    """
+    for partner in frappe.get_all("CRM Partner", filters={"metrics_stale": 1}, pluck="name"):
+        recalculate_partner_metrics(partner)
+
+    frappe.db.sql("""
+        UPDATE `tabCRM Partner`
+        SET partner_score = LEAST(100, FLOOR(
+            LEAST(40, GREATEST(0, IFNULL(total_revenue_generated, 0)) / 1000000 * 40)
+            + LEAST(30, GREATEST(0, IFNULL(lead_conversion_rate, 0)) / 100 * 30)
+            + IF(training_completed, 10, 0)
+            + IF(certification_obtained, 10, 0)
+            + IF(status = 'Active', 5, 0)
+            + IF(agreement_end_date > %s, 5, 0)
+        ))
+    """, (current_date or getdate(),))
+
+
+TERRITORY_PARTNER_FIELDS = ("name", "partner_name", "partner_tier", "partner_score")
 
 
 @frappe.whitelist()
-def get_partners_by_territory(territory):
-    """Get all active partners in a territory"""
+def get_partners_by_territory(territory, fields=None, pluck=None):
+    """
+    Get all active partners in a territory.
+
+    fields narrows the projection and pluck returns a flat list of one
+    field; both are limited to TERRITORY_PARTNER_FIELDS.
+    """
+    fields = frappe.parse_json(fields) if fields else TERRITORY_PARTNER_FIELDS
+    if pluck:
+        fields = [pluck]
+    if not set(fields).issubset(TERRITORY_PARTNER_FIELDS):
+        frappe.throw(_("Only {0} can be requested").format(", ".join(TERRITORY_PARTNER_FIELDS)))
+
     return frappe.get_all("CRM Partner",
         filters={
             "territory": territory,
             "status": "Active"
         },
-        fields=["name", "partner_name", "partner_tier", "partner_score"]
+        fields=list(fields),
+        pluck=pluck
     )
 
 
@@ -342,8 +528,13 @@ def calculate_partner_commission(partner, deal_value):
 
 
 @frappe.whitelist()
-def get_partner_performance_report(partner, from_date=None, to_date=None):
-    """Generate performance report for a partner"""
+def get_partner_performance_report(partner, from_date=None, to_date=None, include_rows=True):
+    """
+    Generate performance report for a partner.
+
+    With include_rows off only the summary is returned, aggregated in SQL
+    without fetching the deal and lead rows.
+    """
     if not from_date:
         from_date = frappe.utils.add_months(today(), -12)
     if not to_date:
@@ -351,6 +542,15 @@ def get_partner_performance_report(partner, from_date=None, to_date=None):
 
     partner_doc = frappe.get_doc("CRM Partner", partner)
 
+    report = {
+        "partner": partner_doc.partner_name,
+        "period": f"{from_date} to {to_date}"
+    }
+
+    if not sbool(include_rows):
+        report["summary"] = get_partner_performance_report_summary(partner, from_date, to_date)
+        return report
+
     # Get deals in date range
     deals = frappe.get_all("CRM Deal",
         filters={
@@ -370,15 +570,53 @@ def get_partner_performance_report(partner, from_date=None, to_date=None):
         fields=["status", "creation", "lead_name"]
     )
 
-    return {
-        "partner": partner_doc.partner_name,
-        "period": f"{from_date} to {to_date}",
+    # Accumulate the summary in a single pass over each result set
+    total_revenue = 0
+    for deal in deals:
+        total_revenue += flt(deal.deal_value)
+
+    converted_leads = 0
+    for lead in leads:
+        if lead.status == "Converted":
+            converted_leads += 1
+
+    report.update({
         "deals": deals,
         "leads": leads,
         "summary": {
             "total_deals": len(deals),
-            "total_revenue": sum([flt(deal.deal_value) for deal in deals]),
+            "total_revenue": total_revenue,
             "total_leads": len(leads),
-            "converted_leads": len([lead for lead in leads if lead.status == "Converted"])
+            "converted_leads": converted_leads
         }
-    }
\ No newline at end of file
+    })
+    return report
+
+
+def get_partner_performance_report_summary(partner, from_date, to_date):
+    """Aggregate the performance report summary in SQL"""
+    deal_stats = frappe.db.sql("""
+        SELECT COUNT(*) as total_deals, COALESCE(SUM(deal_value), 0) as total_revenue
+        FROM `tabCRM Deal`
+        WHERE partner = %s
+            AND status = 'Won'
+            AND closed_date BETWEEN %s AND %s
+    """, (partner, from_date, to_date), as_dict=True)[0]
+
+    # creation is a datetime; include the whole of to_date like get_all's between
+    lead_stats = frappe.db.sql("""
+        SELECT
+            COUNT(*) as total_leads,
+            COALESCE(SUM(CASE WHEN status = 'Converted' THEN 1 ELSE 0 END), 0) as converted_leads
+        FROM `tabCRM Lead`
+        WHERE partner = %s
+            AND creation >= %s
+            AND creation < %s
+    """, (partner, getdate(from_date), add_days(getdate(to_date), 1)), as_dict=True)[0]
+
+    return {
+        "total_deals": cint(deal_stats.total_deals),
+        "total_revenue": flt(deal_stats.total_revenue),
+        "total_leads": cint(lead_stats.total_leads),
+        "converted_leads": cint(lead_stats.converted_leads)
+    }
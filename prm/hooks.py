@@ -157,8 +157,14 @@ doc_events = {
 	},
 	"CRM Deal": {
 		"on_update": [
-			"prm.fprm.doctype.erpnext_crm_settings.erpnext_crm_settings.create_customer_in_erpnext"
+			"prm.fprm.doctype.erpnext_crm_settings.erpnext_crm_settings.create_customer_in_erpnext",
+			"prm.fprm.doctype.crm_partner.crm_partner.mark_partner_metrics_stale",
 		],
+		"on_trash": ["prm.fprm.doctype.crm_partner.crm_partner.mark_partner_metrics_stale"],
+	},
+	"CRM Lead": {
+		"on_update": ["prm.fprm.doctype.crm_partner.crm_partner.mark_partner_metrics_stale"],
+		"on_trash": ["prm.fprm.doctype.crm_partner.crm_partner.mark_partner_metrics_stale"],
 	},
 	"User": {
 		"before_validate": ["prm.api.demo.validate_user"],
@@ -169,23 +175,11 @@ doc_events = {
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# "all": [
-# "crm.tasks.all"
-# ],
-# "daily": [
-# "crm.tasks.daily"
-# ],
-# "hourly": [
-# "crm.tasks.hourly"
-# ],
-# "weekly": [
-# "crm.tasks.weekly"
-# ],
-# "monthly": [
-# "crm.tasks.monthly"
-# ],
-# }
+scheduler_events = {
+	"daily": [
+		"prm.fprm.doctype.crm_partner.crm_partner.refresh_partner_scores",
+	],
+}
 
 # Testing
 # -------
@@ -0,0 +1,8 @@
+from prm.fprm.doctype.crm_deal.crm_deal import on_doctype_update as add_deal_partner_indexes
+from prm.fprm.doctype.crm_lead.crm_lead import on_doctype_update as add_lead_partner_indexes
+
+
+def execute():
+	# Fresh installs get these from the doctypes' on_doctype_update
+	add_deal_partner_indexes()
+	add_lead_partner_indexes()
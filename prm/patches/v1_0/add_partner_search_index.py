@@ -0,0 +1,6 @@
+from prm.api.partner import add_partner_search_index
+
+
+def execute():
+	# Fresh installs get the index from CRM Partner's on_doctype_update
+	add_partner_search_index()
@@ -3,175 +3,232 @@
 
 import frappe
 from frappe import _
-from frappe.permissions import add_permission, update_permission_property
+from frappe.permissions import setup_custom_perms
+from frappe.utils import cint, now
+from frappe.utils.caching import request_cache
+
+PERM_COLUMNS = (
+    "read", "write", "create", "delete", "submit", "cancel", "amend",
+    "report", "export", "import", "share", "print", "email", "if_owner"
+)
+
+DOCPERM_FIELDS = (
+    "name", "parent", "parenttype", "parentfield", "role", "permlevel",
+    *PERM_COLUMNS,
+    "owner", "modified_by", "creation", "modified"
+)
+
+PARTNER_FOR_USER_CACHE_KEY = "prm:partner_for_user"
+
+# Partners are restricted to records linked to their CRM Partner
+PARTNER_USER_PERMISSION_DOCTYPES = '["CRM Partner"]'
+# applicable_for links a single doctype, so each gets its own User Permission
+PARTNER_USER_PERMISSION_APPLICABLE_FOR = ("CRM Partner", "CRM Lead", "CRM Deal")
+
+_FULL_ACCESS_ROLES = frozenset({"System Manager", "CRM Manager", "Partner Manager", "Partner Admin"})
+
+# (role name, desk access, description)
+PARTNER_ROLES = (
+    ("Partner Manager", 1, "Manages partner relationships and oversees partner operations"),
+    ("Partner", 0, "External partner with limited access to their own data"),
+    ("Partner Admin", 1, "Administrative access to partner management system"),
+)
+
+# Permlevel 0 flags per doctype and role; flags left out are cleared
+PARTNER_DOCTYPE_PERMISSIONS = {
+    "CRM Partner": {
+        # Full access
+        "Partner Manager": {
+            "read": 1, "write": 1, "create": 1, "delete": 1, "report": 1, "export": 1,
+            "import": 1, "share": 1, "print": 1, "email": 1
+        },
+        # Full access
+        "Partner Admin": {
+            "read": 1, "write": 1, "create": 1, "delete": 1, "report": 1, "export": 1,
+            "import": 1, "share": 1, "print": 1, "email": 1
+        },
+        # Full access
+        "CRM Manager": {
+            "read": 1, "write": 1, "create": 1, "delete": 1, "report": 1, "export": 1,
+            "print": 1, "email": 1
+        },
+        # Read and Write
+        "CRM User": {"read": 1, "write": 1, "report": 1, "export": 1, "print": 1, "email": 1},
+        # Read only their own record
+        "Partner": {"read": 1, "if_owner": 1, "print": 1}
+    },
+    "CRM Lead": {
+        # Full access to partner leads
+        "Partner Manager": {
+            "read": 1, "write": 1, "create": 1, "report": 1, "export": 1, "print": 1, "email": 1
+        },
+        # Read leads assigned to them
+        "Partner": {"read": 1, "write": 1, "user_permission_doctypes": PARTNER_USER_PERMISSION_DOCTYPES}
+    },
+    "CRM Deal": {
+        "Partner Manager": {
+            "read": 1, "write": 1, "create": 1, "report": 1, "export": 1, "print": 1, "email": 1
+        },
+        # Read/Write deals assigned to them
+        "Partner": {"read": 1, "write": 1, "user_permission_doctypes": PARTNER_USER_PERMISSION_DOCTYPES}
+    }
+}
 
 
 def setup_partner_permissions():
     """
     Set up permissions for Partner Management System.
     This should be called during app installation or migration.
+
+    All writes run in one transaction that is committed once at the end.
     """
 
-    # Create Partner-specific roles if they don't exist
-    create_partner_roles()
+    frappe.db.savepoint("partner_perms_setup")
+    try:
+        # Create Partner-specific roles if they don't exist
+        create_partner_roles()
+
+        # Set up DocType permissions
+        setup_partner_doctype_permissions()
+        setup_lead_partner_permissions()
+        setup_deal_partner_permissions()
+
+        # Set up user permissions for partner isolation
+        setup_partner_user_permissions()
+    except Exception:
+        frappe.db.rollback(save_point="partner_perms_setup")
+        raise
 
-    # Set up DocType permissions
-    setup_partner_doctype_permissions()
-    setup_lead_partner_permissions()
-    setup_deal_partner_permissions()
+    frappe.db.commit()
 
-    # Set up user permissions for partner isolation
-    setup_partner_user_permissions()
+    # The helpers leave the caches alone; invalidate each doctype once
+    for doctype in PARTNER_DOCTYPE_PERMISSIONS:
+        frappe.clear_cache(doctype=doctype)
 
 
 def create_partner_roles():
     """Create Partner-specific roles"""
 
-    partner_roles = [
-        {
-            "role_name": "Partner Manager",
-            "description": "Manages partner relationships and oversees partner operations"
-        },
-        {
-            "role_name": "Partner",
-            "description": "External partner with limited access to their own data"
-        },
-        {
-            "role_name": "Partner Admin",
-            "description": "Administrative access to partner management system"
-        }
+    existing_roles = set(frappe.get_all("Role",
+        filters={"name": ["in", [role_name for role_name, _desk_access, _description in PARTNER_ROLES]]},
+        pluck="name"
+    ))
+
+    # Role has no description field; the descriptions only document intent
+    timestamp = now()
+    user = frappe.session.user
+    values = [
+        (role_name, role_name, desk_access, user, user, timestamp, timestamp)
+        for role_name, desk_access, _description in PARTNER_ROLES
+        if role_name not in existing_roles
     ]
 
-    for role_data in partner_roles:
-        if not frappe.db.exists("Role", role_data["role_name"]):
-            role_doc = frappe.get_doc({
-                "doctype": "Role",
-                "role_name": role_data["role_name"],
-                "desk_access": 1 if role_data["role_name"] != "Partner" else 0,
-                "description": role_data["description"]
-            })
-            role_doc.insert(ignore_permissions=True)
+    if values:
+        frappe.db.bulk_insert("Role",
+            fields=["name", "role_name", "desk_access", "owner", "modified_by", "creation", "modified"],
+            values=values
+        )
 
 
 def setup_partner_doctype_permissions():
-    """Set up permissions for CRM Partner DocType"""
+    """
+    Set up permissions for CRM Partner DocType.
 
-    # Clear existing permissions
-    frappe.db.delete("Custom DocPerm", {
-        "parent": "CRM Partner",
-        "parenttype": "DocType"
-    })
+    Managed role rows are synced in place: matching rows are left alone,
+    differing ones are updated and missing ones inserted.
+    """
+    managed_permissions = PARTNER_DOCTYPE_PERMISSIONS["CRM Partner"]
+    to_insert = []
+
+    # Custom DocPerm replaces the standard permissions once it has rows, so
+    # copy those first, as _add_missing_docperms does
+    setup_custom_perms("CRM Partner")
+
+    existing_permissions = {}
+    duplicates = []
+    for perm in frappe.get_all("Custom DocPerm",
+        filters={
+            "parent": "CRM Partner",
+            "parenttype": "DocType",
+            "permlevel": 0,
+            "role": ["in", list(managed_permissions)]
+        },
+        fields=["name", "role", *PERM_COLUMNS]
+    ):
+        if perm.role in existing_permissions:
+            duplicates.append(perm.name)
+        else:
+            existing_permissions[perm.role] = perm
+
+    for role, flags in managed_permissions.items():
+        desired = {ptype: cint(flags.get(ptype)) for ptype in PERM_COLUMNS}
+        current = existing_permissions.get(role)
+        if not current:
+            to_insert.append({"role": role, **desired})
+        elif any(cint(current[ptype]) != value for ptype, value in desired.items()):
+            frappe.db.set_value("Custom DocPerm", current.name, desired, update_modified=False)
 
-    # Partner Manager permissions - Full access
-    add_permission("CRM Partner", "Partner Manager", 0)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "read", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "write", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "create", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "delete", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "submit", 0)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "cancel", 0)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "amend", 0)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "report", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "export", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "import", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "share", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "print", 1)
-    update_permission_property("CRM Partner", "Partner Manager", 0, "email", 1)
-
-    # Partner Admin permissions - Full access
-    add_permission("CRM Partner", "Partner Admin", 0)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "read", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "write", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "create", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "delete", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "report", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "export", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "import", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "share", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "print", 1)
-    update_permission_property("CRM Partner", "Partner Admin", 0, "email", 1)
-
-    # CRM Manager permissions - Full access
-    add_permission("CRM Partner", "CRM Manager", 0)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "read", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "write", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "create", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "delete", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "report", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "export", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "print", 1)
-    update_permission_property("CRM Partner", "CRM Manager", 0, "email", 1)
-
-    # CRM User permissions - Read and Write
-    add_permission("CRM Partner", "CRM User", 0)
-    update_permission_property("CRM Partner", "CRM User", 0, "read", 1)
-    update_permission_property("CRM Partner", "CRM User", 0, "write", 1)
-    update_permission_property("CRM Partner", "CRM User", 0, "report", 1)
-    update_permission_property("CRM Partner", "CRM User", 0, "export", 1)
-    update_permission_property("CRM Partner", "CRM User", 0, "print", 1)
-    update_permission_property("CRM Partner", "CRM User", 0, "email", 1)
-
-    # Partner permissions - Read only their own record
-    add_permission("CRM Partner", "Partner", 0)
-    update_permission_property("CRM Partner", "Partner", 0, "read", 1)
-    update_permission_property("CRM Partner", "Partner", 0, "if_owner", 1)
-    update_permission_property("CRM Partner", "Partner", 0, "print", 1)
+    if duplicates:
+        frappe.db.delete("Custom DocPerm", {"name": ["in", duplicates]})
+    _insert_docperms("CRM Partner", to_insert)
 
 
 def setup_lead_partner_permissions():
     """Set up partner-specific permissions for CRM Lead"""
-
-    # Partner Manager permissions - Full access to partner leads
-    if not frappe.db.exists("Custom DocPerm", {
-        "parent": "CRM Lead",
-        "role": "Partner Manager"
-    }):
-        add_permission("CRM Lead", "Partner Manager", 0)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "read", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "write", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "create", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "report", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "export", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "print", 1)
-        update_permission_property("CRM Lead", "Partner Manager", 0, "email", 1)
-
-    # Partner permissions - Read leads assigned to them
-    if not frappe.db.exists("Custom DocPerm", {
-        "parent": "CRM Lead",
-        "role": "Partner"
-    }):
-        add_permission("CRM Lead", "Partner", 0)
-        update_permission_property("CRM Lead", "Partner", 0, "read", 1)
-        update_permission_property("CRM Lead", "Partner", 0, "write", 1)
-        update_permission_property("CRM Lead", "Partner", 0, "user_permission_doctypes", '["CRM Partner"]')
+    _add_missing_docperms("CRM Lead")
 
 
 def setup_deal_partner_permissions():
     """Set up partner-specific permissions for CRM Deal"""
+    _add_missing_docperms("CRM Deal")
+
+
+def _add_missing_docperms(parent):
+    """Insert the partner role permissions a doctype does not have yet"""
+
+    existing_roles = set(frappe.get_all("Custom DocPerm", filters={"parent": parent}, pluck="role"))
+
+    # Copy the standard permissions first, as add_permission would
+    if not existing_roles and setup_custom_perms(parent):
+        existing_roles = set(frappe.get_all("Custom DocPerm", filters={"parent": parent}, pluck="role"))
+
+    missing = [
+        {"role": role, **flags}
+        for role, flags in PARTNER_DOCTYPE_PERMISSIONS[parent].items()
+        if role not in existing_roles
+    ]
+    _insert_docperms(parent, missing)
+
 
-    # Partner Manager permissions
-    if not frappe.db.exists("Custom DocPerm", {
-        "parent": "CRM Deal",
-        "role": "Partner Manager"
-    }):
-        add_permission("CRM Deal", "Partner Manager", 0)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "read", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "write", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "create", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "report", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "export", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "print", 1)
-        update_permission_property("CRM Deal", "Partner Manager", 0, "email", 1)
-
-    # Partner permissions - Read/Write deals assigned to them
-    if not frappe.db.exists("Custom DocPerm", {
-        "parent": "CRM Deal",
-        "role": "Partner"
-    }):
-        add_permission("CRM Deal", "Partner", 0)
-        update_permission_property("CRM Deal", "Partner", 0, "read", 1)
-        update_permission_property("CRM Deal", "Partner", 0, "write", 1)
-        update_permission_property("CRM Deal", "Partner", 0, "user_permission_doctypes", '["CRM Partner"]')
+def _insert_docperms(parent, permissions):
+    """
+    Write Custom DocPerm rows with a single multi-row INSERT.
+
+    Each permission is a dict with the role, an optional permlevel and its
+    flags; flags not given are cleared. A `user_permission_doctypes` value
+    is written in the same row on sites whose DocPerm still has the column.
+    """
+    if not permissions:
+        return
+
+    extra_fields = ()
+    if frappe.db.has_column("Custom DocPerm", "user_permission_doctypes"):
+        extra_fields = ("user_permission_doctypes",)
+
+    timestamp = now()
+    user = frappe.session.user
+    values = [
+        (
+            frappe.generate_hash(length=10), parent, "DocType", "permissions",
+            perm["role"], cint(perm.get("permlevel")),
+            *(cint(perm.get(ptype)) for ptype in PERM_COLUMNS),
+            user, user, timestamp, timestamp,
+            *(perm.get(field) for field in extra_fields)
+        )
+        for perm in permissions
+    ]
+
+    frappe.db.bulk_insert("Custom DocPerm", fields=(*DOCPERM_FIELDS, *extra_fields), values=values)
 
 
 def setup_partner_user_permissions():
@@ -191,22 +248,59 @@ def apply_partner_user_permission(user_email, partner_name):
         user_email (str): Email of the partner user
         partner_name (str): Name of the partner document
     """
+    apply_partner_user_permissions([(user_email, partner_name)])
 
-    # Remove existing user permissions for this user and partner
-    frappe.db.delete("User Permission", {
-        "user": user_email,
-        "allow": "CRM Partner"
-    })
 
-    # Add new user permission
-    user_permission = frappe.get_doc({
-        "doctype": "User Permission",
-        "user": user_email,
-        "allow": "CRM Partner",
-        "for_value": partner_name,
-        "applicable_for": "CRM Lead,CRM Deal,CRM Activity"
-    })
-    user_permission.insert(ignore_permissions=True)
+def apply_partner_user_permissions(user_partners, chunk_size=10000):
+    """
+    Apply partner user permissions for many users at once.
+
+    Existing CRM Partner user permissions of these users are replaced using
+    one DELETE and chunked multi-row INSERTs, with one row per doctype in
+    PARTNER_USER_PERMISSION_APPLICABLE_FOR.
+
+    Args:
+        user_partners (list): (user_email, partner_name) pairs
+        chunk_size (int): Rows per INSERT statement
+    """
+    user_partners = dict(user_partners)
+    if not user_partners:
+        return
+
+    users = list(user_partners)
+
+    # Remove existing user permissions for these users; first-time
+    # onboarding has none, so skip the DELETE unless a read finds some
+    existing = frappe.get_all("User Permission",
+        filters={"user": ["in", users], "allow": "CRM Partner"},
+        pluck="name"
+    )
+    if existing:
+        frappe.db.delete("User Permission", {"name": ["in", existing]})
+
+    # Add new user permissions
+    timestamp = now()
+    owner = frappe.session.user
+    values = [
+        (
+            frappe.generate_hash(length=10), user_email, "CRM Partner", partner_name,
+            0, applicable_for, owner, owner, timestamp, timestamp
+        )
+        for user_email, partner_name in user_partners.items()
+        for applicable_for in PARTNER_USER_PERMISSION_APPLICABLE_FOR
+    ]
+    frappe.db.bulk_insert("User Permission",
+        fields=[
+            "name", "user", "allow", "for_value", "apply_to_all_doctypes", "applicable_for",
+            "owner", "modified_by", "creation", "modified"
+        ],
+        values=values,
+        chunk_size=chunk_size
+    )
+
+    # The document hooks that normally reset these caches were bypassed
+    frappe.cache.hdel("user_permissions", *users)
+    clear_partner_user_cache(*users)
 
 
 def remove_partner_user_permission(user_email, partner_name):
@@ -223,6 +317,7 @@ def remove_partner_user_permission(user_email, partner_name):
         "allow": "CRM Partner",
         "for_value": partner_name
     })
+    clear_partner_user_cache(user_email)
 
 
 def get_partner_permission_query_conditions(user=None):
@@ -240,20 +335,20 @@ def get_partner_permission_query_conditions(user=None):
     if not user:
         user = frappe.session.user
 
-    # System Manager and Administrator have full access
-    if "System Manager" in frappe.get_roles(user) or user == "Administrator":
+    # Administrator has full access; skip the role lookup altogether
+    if user == "Administrator":
         return ""
 
-    # CRM Manager and Partner Manager have full access
-    user_roles = frappe.get_roles(user)
-    if "CRM Manager" in user_roles or "Partner Manager" in user_roles or "Partner Admin" in user_roles:
+    # System Manager, CRM Manager and the partner managers have full access
+    user_roles = _roles(user)
+    if user_roles & _FULL_ACCESS_ROLES:
         return ""
 
     # Partner users only see their own partner record
     if "Partner" in user_roles:
-        partner = frappe.db.get_value("CRM Partner", {"email": user}, "name")
+        partner = _partner_for(user)
         if partner:
-            return f"`tabCRM Partner`.name = '{partner}'"
+            return f"`tabCRM Partner`.name = {frappe.db.escape(partner)}"
         else:
             return "1=0"  # No access if no partner record found
 
@@ -265,6 +360,28 @@ def get_partner_permission_query_conditions(user=None):
     return "1=0"
 
 
+@request_cache
+def _roles(user):
+    """Roles of a user as a frozenset, resolved once per request"""
+    return frozenset(frappe.get_roles(user))
+
+
+@request_cache
+def _partner_for(user):
+    """CRM Partner linked to a user's email, cached in redis across requests"""
+    return frappe.cache.hget(
+        PARTNER_FOR_USER_CACHE_KEY,
+        user,
+        generator=lambda: frappe.db.get_value("CRM Partner", {"email": user}, "name")
+    )
+
+
+def clear_partner_user_cache(*users):
+    """Forget the cached partner of the given users"""
+    for user in filter(None, users):
+        frappe.cache.hdel(PARTNER_FOR_USER_CACHE_KEY, user)
+
+
 def has_partner_permission(doc, user=None, permission_type="read"):
     """
     Check if user has permission for a specific partner document.
@@ -281,13 +398,13 @@ def has_partner_permission(doc, user=None, permission_type="read"):
     if not user:
         user = frappe.session.user
 
-    # System Manager and Administrator have full access
-    if "System Manager" in frappe.get_roles(user) or user == "Administrator":
+    # Administrator has full access; skip the role lookup altogether
+    if user == "Administrator":
         return True
 
-    # CRM Manager and Partner Manager have full access
-    user_roles = frappe.get_roles(user)
-    if "CRM Manager" in user_roles or "Partner Manager" in user_roles or "Partner Admin" in user_roles:
+    # System Manager, CRM Manager and the partner managers have full access
+    user_roles = _roles(user)
+    if user_roles & _FULL_ACCESS_ROLES:
         return True
 
     # Partner users only access their own record
@@ -305,39 +422,27 @@ def has_partner_permission(doc, user=None, permission_type="read"):
 
 
 # Permission query hooks for doctypes
-def get_crm_lead_permission_query_conditions(user=None):
-    """Permission query for CRM Lead based on partner assignment"""
-
-    if not user:
-        user = frappe.session.user
-
-    user_roles = frappe.get_roles(user)
-
-    # Partner users only see leads assigned to their partner
-    if "Partner" in user_roles:
-        partner = frappe.db.get_value("CRM Partner", {"email": user}, "name")
-        if partner:
-            return f"`tabCRM Lead`.partner = '{partner}'"
-        else:
-            return "1=0"
-
-    return ""
+def _make_partner_query_conditions(doctype, partner_field="partner"):
+    """
+    Build a permission query hook restricting Partner users to the records
+    of `doctype` linked to their own partner through `partner_field`.
+    """
+    condition = f"`tab{doctype}`.`{partner_field}` = {{}}"
 
+    def get_permission_query_conditions(user=None):
+        if not user:
+            user = frappe.session.user
 
-def get_crm_deal_permission_query_conditions(user=None):
-    """Permission query for CRM Deal based on partner assignment"""
+        # Only Partner users need their CRM Partner looked up
+        if user == "Administrator" or "Partner" not in _roles(user):
+            return ""
 
-    if not user:
-        user = frappe.session.user
+        partner = _partner_for(user)
+        return condition.format(frappe.db.escape(partner)) if partner else "1=0"
 
-    user_roles = frappe.get_roles(user)
+    get_permission_query_conditions.__doc__ = f"Permission query for {doctype} based on partner assignment"
+    return get_permission_query_conditions
 
-    # Partner users only see deals assigned to their partner
-    if "Partner" in user_roles:
-        partner = frappe.db.get_value("CRM Partner", {"email": user}, "name")
-        if partner:
-            return f"`tabCRM Deal`.partner = '{partner}'"
-        else:
-            return "1=0"
 
-    return ""
\ No newline at end of file
+get_crm_lead_permission_query_conditions = _make_partner_query_conditions("CRM Lead")
+get_crm_deal_permission_query_conditions = _make_partner_query_conditions("CRM Deal")
@@ -1,10 +1,125 @@
 # Copyright (c) 2024, Zinye Technologies and contributors
 # For license information, please see license.txt
 
+import os
+import time
 import unittest
+from collections import Counter
+
 import frappe
-from frappe.utils import today
-from frappe.test_runner import make_test_records
+from frappe.utils import now
+
+from prm.api.partner import (
+    get_partner_list,
+    get_partner_details,
+    create_partner,
+    update_partner,
+    assign_lead_to_partner,
+    assign_leads_to_partner,
+    search_partners,
+    partner_dashboard_stats
+)
+from prm.fprm.doctype.crm_partner.crm_partner import calculate_partner_commission
+from prm.tests.utils import make_partner, partner_values
+
+# Set PRM_TEST_PROFILE=1 to log per-test setUp-to-tearDown timings
+PROFILE_TESTS = bool(os.environ.get("PRM_TEST_PROFILE"))
+
+BULK_PARTNER_FIELDS = (
+    "name", "partner_name", "partner_type", "partner_tier", "email",
+    "status", "territory", "commission_rate", "creation", "modified"
+)
+
+_LIST_EMAILS = tuple(f"api{i}@apitest.com" for i in range(1, 4))
+_SEARCH_EMAILS = ("alpha@apitest.com", "beta@apitest.com", "gamma@apitest.com")
+_STATS_EMAILS = tuple(f"stats{i}@apitest.com" for i in range(1, 4))
+_COMMISSION_EMAILS = ("commission@apitest.com", "norate@apitest.com")
+
+# Read-only partners shared by the list, search, stats and commission tests;
+# each test picks the rows it needs by attribute
+PARTNERS_CATALOG = [
+    # List
+    *(
+        partner_values(partner_name=f"API Test Partner {i+1}", email=email, status="Active")
+        for i, email in enumerate(_LIST_EMAILS)
+    ),
+    # Search
+    partner_values(
+        partner_name="Alpha Search Partner",
+        email=_SEARCH_EMAILS[0],
+        territory="North America",
+        status="Active"
+    ),
+    partner_values(
+        partner_name="Beta Search Partner",
+        partner_type="Distributor",
+        partner_tier="Silver",
+        email=_SEARCH_EMAILS[1],
+        territory="Europe",
+        status="Active"
+    ),
+    partner_values(
+        partner_name="Gamma Technologies",
+        partner_type="Technology Partner",
+        email=_SEARCH_EMAILS[2],
+        territory="Asia",
+        status="Active"
+    ),
+    # Dashboard stats, one per status
+    *(
+        partner_values(partner_name=f"Stats Partner {i+1}", email=email, status=status)
+        for i, (email, status) in enumerate(zip(_STATS_EMAILS, ["Active", "Pending Approval", "Inactive"], strict=True))
+    ),
+    # Commission, with and without a rate
+    partner_values(
+        partner_name="Commission Test Partner",
+        email=_COMMISSION_EMAILS[0],
+        commission_rate=15.0,
+        status="Active"
+    ),
+    partner_values(
+        partner_name="No Rate Partner",
+        email=_COMMISSION_EMAILS[1],
+        status="Active"
+    )
+]
+
+
+def _bulk_insert_partners(partners):
+    """
+    Write plain CRM Partner rows with one multi-row INSERT.
+
+    Skips the controller entirely; only for tests that just need the rows
+    to exist. Returns the generated names.
+    """
+    timestamp = now()
+    values = [
+        (
+            frappe.generate_hash(length=10), partner["partner_name"], partner["partner_type"],
+            partner["partner_tier"], partner["email"], partner["status"],
+            partner.get("territory"), partner.get("commission_rate", 0), timestamp, timestamp
+        )
+        for partner in partners
+    ]
+    frappe.db.bulk_insert("CRM Partner", fields=BULK_PARTNER_FIELDS, values=values)
+    return [row[0] for row in values]
+
+
+def _make_lead_raw(lead_name, email):
+    """Insert a bare CRM Lead row with one INSERT, skipping the lead controller; returns its name"""
+    name = frappe.generate_hash(length=10)
+    timestamp = now()
+    frappe.db.sql("""
+        INSERT INTO `tabCRM Lead` (name, lead_name, email, owner, modified_by, creation, modified)
+        VALUES (%(name)s, %(lead_name)s, %(email)s, %(user)s, %(user)s, %(timestamp)s, %(timestamp)s)
+    """, {
+        "name": name,
+        "lead_name": lead_name,
+        "email": email,
+        "user": frappe.session.user,
+        "timestamp": timestamp
+    })
+    return name
 
 
 class TestPartnerAPI(unittest.TestCase):
@@ -13,36 +128,46 @@ class TestPartnerAPI(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Set up test data"""
-        make_test_records("Country")
-        make_test_records("Territory")
+        # Territories are plain link values here: the catalog is bulk
+        # inserted and nothing validates them, so no test records are needed
+        # Clean up rows left behind by an aborted run, by their known emails
+        frappe.db.delete("CRM Partner", {"email": ["in", [partner["email"] for partner in PARTNERS_CATALOG]]})
+
+        cls.shared_partner_names = _bulk_insert_partners(PARTNERS_CATALOG)
+        cls.shared_partner_by_email = {
+            partner["email"]: name for partner, name in zip(PARTNERS_CATALOG, cls.shared_partner_names, strict=True)
+        }
+        frappe.db.commit()
+
+        # Aggregated once; no test changes the shared partners
+        cls._stats = partner_dashboard_stats()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the shared partners"""
+        frappe.db.delete("CRM Partner", {"name": ["in", cls.shared_partner_names]})
+        frappe.db.commit()
 
     def setUp(self):
         """Set up before each test"""
-        # Clean up existing test data
-        frappe.db.delete("CRM Partner", {"email": ["like", "%apitest.com"]})
-        frappe.db.commit()
+        # Partners and leads a test creates are rolled back in tearDown
+        frappe.db.savepoint("test_sp")
+        if PROFILE_TESTS:
+            self._started = time.perf_counter()
 
     def tearDown(self):
         """Clean up after each test"""
-        frappe.db.delete("CRM Partner", {"email": ["like", "%apitest.com"]})
-        frappe.db.commit()
+        frappe.db.rollback(save_point="test_sp")
+        if PROFILE_TESTS:
+            frappe.logger("prm.tests").info(f"{self.id()}: {time.perf_counter() - self._started:.3f}s")
+
+    def _ns(self):
+        """Per-test email namespace, so tests can run concurrently without collisions"""
+        # Underscores are not valid in email domains
+        return self._testMethodName.removeprefix("test_").replace("_", "-")
 
     def test_get_partner_list_api(self):
         """Test get_partner_list API function"""
-        from prm.api.partner import get_partner_list
-
-        # Create test partners
-        for i in range(3):
-            partner = frappe.get_doc({
-                "doctype": "CRM Partner",
-                "partner_name": f"API Test Partner {i+1}",
-                "partner_type": "Reseller",
-                "partner_tier": "Gold",
-                "email": f"api{i+1}@apitest.com",
-                "status": "Active"
-            })
-            partner.insert()
-
         # Test basic list
         result = get_partner_list()
         self.assertIn("partners", result)
@@ -59,7 +184,8 @@ class TestPartnerAPI(unittest.TestCase):
 
         # Test with search
         result_search = get_partner_list(search_term="API Test")
-        self.assertGreaterEqual(len(result_search["partners"]), 3)
+        expected = [p for p in PARTNERS_CATALOG if p["partner_name"].startswith("API Test")]
+        self.assertGreaterEqual(len(result_search["partners"]), len(expected))
 
         # Test pagination
         result_page = get_partner_list(limit=2, start=0)
@@ -67,19 +193,16 @@ class TestPartnerAPI(unittest.TestCase):
 
     def test_get_partner_details_api(self):
         """Test get_partner_details API function"""
-        from prm.api.partner import get_partner_details
-
         # Create test partner
-        partner = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "Details Test Partner",
-            "partner_type": "Distributor",
-            "partner_tier": "Silver",
-            "email": "details@apitest.com",
-            "primary_contact": "John Doe",
-            "phone": "+1-555-0123"
-        })
-        partner.insert()
+        partner = make_partner(
+            partner_name="Details Test Partner",
+            partner_type="Distributor",
+            partner_tier="Silver",
+            email=f"details@{self._ns()}.apitest.com",
+            primary_contact="John Doe",
+            phone="+1-555-0123",
+            status="Active"
+        )
 
         # Test API
         result = get_partner_details(partner.name)
@@ -90,7 +213,7 @@ class TestPartnerAPI(unittest.TestCase):
 
         partner_data = result["partner"]
         self.assertEqual(partner_data["partner_name"], "Details Test Partner")
-        self.assertEqual(partner_data["email"], "details@apitest.com")
+        self.assertEqual(partner_data["email"], f"details@{self._ns()}.apitest.com")
 
         # Test with non-existent partner
         with self.assertRaises(frappe.DoesNotExistError):
@@ -98,13 +221,11 @@ class TestPartnerAPI(unittest.TestCase):
 
     def test_create_partner_api(self):
         """Test create_partner API function"""
-        from prm.api.partner import create_partner
-
         partner_data = {
             "partner_name": "Created Test Partner",
             "partner_type": "Affiliate",
             "partner_tier": "Bronze",
-            "email": "created@apitest.com",
+            "email": f"created@{self._ns()}.apitest.com",
             "primary_contact": "Jane Smith",
             "phone": "+1-555-0456",
             "commission_rate": 12.5
@@ -121,15 +242,15 @@ class TestPartnerAPI(unittest.TestCase):
         self.assertEqual(created_partner["partner_type"], "Affiliate")
 
         # Verify in database
-        db_partner = frappe.get_doc("CRM Partner", created_partner["name"])
-        self.assertEqual(db_partner.email, "created@apitest.com")
+        db_email = frappe.db.get_value("CRM Partner", created_partner["name"], "email")
+        self.assertEqual(db_email, f"created@{self._ns()}.apitest.com")
 
         # Test validation errors
         invalid_data = {
             "partner_name": "",  # Missing required field
             "partner_type": "Reseller",
             "partner_tier": "Gold",
-            "email": "invalid@apitest.com"
+            "email": f"invalid@{self._ns()}.apitest.com"
         }
 
         with self.assertRaises(frappe.ValidationError):
@@ -140,7 +261,7 @@ class TestPartnerAPI(unittest.TestCase):
             "partner_name": "Duplicate Partner",
             "partner_type": "Reseller",
             "partner_tier": "Gold",
-            "email": "created@apitest.com"  # Same email as above
+            "email": f"created@{self._ns()}.apitest.com"  # Same email as above
         }
 
         with self.assertRaises(frappe.ValidationError):
@@ -148,17 +269,12 @@ class TestPartnerAPI(unittest.TestCase):
 
     def test_update_partner_api(self):
         """Test update_partner API function"""
-        from prm.api.partner import update_partner
-
         # Create test partner
-        partner = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "Update Test Partner",
-            "partner_type": "Reseller",
-            "partner_tier": "Gold",
-            "email": "update@apitest.com"
-        })
-        partner.insert()
+        partner = make_partner(
+            partner_name="Update Test Partner",
+            email=f"update@{self._ns()}.apitest.com",
+            status="Active"
+        )
 
         # Test update
         update_data = {
@@ -172,10 +288,13 @@ class TestPartnerAPI(unittest.TestCase):
         self.assertIn("partner", result)
 
         # Verify update
-        updated_partner = frappe.get_doc("CRM Partner", partner.name)
-        self.assertEqual(updated_partner.partner_tier, "Platinum")
-        self.assertEqual(updated_partner.commission_rate, 20.0)
-        self.assertEqual(updated_partner.primary_contact, "Updated Contact")
+        updated_partner = frappe.db.get_value("CRM Partner", partner.name,
+            ["partner_tier", "commission_rate", "primary_contact"],
+            as_dict=True
+        )
+        self.assertEqual(updated_partner["partner_tier"], "Platinum")
+        self.assertEqual(updated_partner["commission_rate"], 20.0)
+        self.assertEqual(updated_partner["primary_contact"], "Updated Contact")
 
         # Test update non-existent partner
         with self.assertRaises(frappe.DoesNotExistError):
@@ -183,30 +302,19 @@ class TestPartnerAPI(unittest.TestCase):
 
     def test_assign_lead_to_partner_api(self):
         """Test assign_lead_to_partner API function"""
-        from prm.api.partner import assign_lead_to_partner
-
         # Create test partner
-        partner = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "Lead Assignment Partner",
-            "partner_type": "Reseller",
-            "partner_tier": "Gold",
-            "email": "leadassign@apitest.com",
-            "status": "Active"
-        })
-        partner.insert()
+        partner = make_partner(
+            partner_name="Lead Assignment Partner",
+            email=f"leadassign@{self._ns()}.apitest.com",
+            status="Active"
+        )
 
         # Create test lead
-        lead = frappe.get_doc({
-            "doctype": "CRM Lead",
-            "lead_name": "Assignment Test Lead",
-            "email": "testlead@apitest.com"
-        })
-        lead.insert()
+        lead_name = _make_lead_raw("Assignment Test Lead", f"testlead@{self._ns()}.apitest.com")
 
         # Test assignment
         result = assign_lead_to_partner(
-            lead.name,
+            lead_name,
             partner.name,
             "API test assignment"
         )
@@ -216,66 +324,68 @@ class TestPartnerAPI(unittest.TestCase):
         self.assertIn("lead", result)
 
         # Verify assignment
-        updated_lead = frappe.get_doc("CRM Lead", lead.name)
-        self.assertEqual(updated_lead.partner, partner.name)
+        self.assertEqual(frappe.db.get_value("CRM Lead", lead_name, "partner"), partner.name)
 
         # Test assignment to inactive partner
-        inactive_partner = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "Inactive Partner",
-            "partner_type": "Reseller",
-            "partner_tier": "Gold",
-            "email": "inactive@apitest.com",
-            "status": "Inactive"
-        })
-        inactive_partner.insert()
-
-        lead2 = frappe.get_doc({
-            "doctype": "CRM Lead",
-            "lead_name": "Test Lead 2",
-            "email": "testlead2@apitest.com"
-        })
-        lead2.insert()
+        inactive_partner = make_partner(
+            partner_name="Inactive Partner",
+            email=f"inactive@{self._ns()}.apitest.com",
+            status="Inactive"
+        )
 
-        with self.assertRaises(frappe.ValidationError):
-            assign_lead_to_partner(lead2.name, inactive_partner.name)
+        second_lead = _make_lead_raw("Test Lead 2", f"testlead2@{self._ns()}.apitest.com")
 
-    def test_search_partners_api(self):
-        """Test search_partners API function"""
-        from prm.api.partner import search_partners
-
-        # Create test partners
-        partners_data = [
-            {
-                "partner_name": "Alpha Search Partner",
-                "partner_type": "Reseller",
-                "partner_tier": "Gold",
-                "email": "alpha@apitest.com",
-                "territory": "North America"
-            },
-            {
-                "partner_name": "Beta Search Partner",
-                "partner_type": "Distributor",
-                "partner_tier": "Silver",
-                "email": "beta@apitest.com",
-                "territory": "Europe"
-            },
-            {
-                "partner_name": "Gamma Technologies",
-                "partner_type": "Technology Partner",
-                "partner_tier": "Gold",
-                "email": "gamma@apitest.com",
-                "territory": "Asia"
-            }
+        with self.assertRaises(frappe.ValidationError):
+            assign_lead_to_partner(second_lead, inactive_partner.name)
+
+    def test_assign_leads_to_partner_api(self):
+        """Test assign_leads_to_partner API function"""
+        partner = make_partner(
+            partner_name="Bulk Assignment Partner",
+            email=f"bulkassign@{self._ns()}.apitest.com",
+            status="Active"
+        )
+        lead_names = [
+            _make_lead_raw(f"Bulk Lead {i+1}", f"bulklead{i+1}@{self._ns()}.apitest.com")
+            for i in range(3)
         ]
 
-        for data in partners_data:
-            partner = frappe.get_doc({
-                "doctype": "CRM Partner",
-                **data
-            })
-            partner.insert()
+        result = assign_leads_to_partner(lead_names, partner.name, "API bulk assignment")
+        self.assertTrue(result["success"])
+
+        # Every lead is assigned and gets one timeline comment
+        assigned = frappe.get_all("CRM Lead", filters={"name": ["in", lead_names]}, pluck="partner")
+        self.assertEqual(assigned, [partner.name] * 3)
+
+        comments = frappe.get_all("Comment",
+            filters={"reference_doctype": "CRM Lead", "reference_name": ["in", lead_names]},
+            fields=["comment_type", "content"]
+        )
+        self.assertEqual(len(comments), 3)
+        for comment in comments:
+            self.assertEqual(comment.comment_type, "Info")
+            self.assertEqual(comment.content, "API bulk assignment")
+
+        # The reason is sanitized before it reaches the timeline
+        assign_leads_to_partner(lead_names[:1], partner.name, "<script>alert(1)</script>Reassigned")
+        contents = frappe.get_all("Comment",
+            filters={"reference_doctype": "CRM Lead", "reference_name": lead_names[0]},
+            pluck="content"
+        )
+        self.assertTrue(any("Reassigned" in content for content in contents))
+        self.assertFalse(any("<script" in content for content in contents))
 
+        # Test assignment to inactive partner
+        inactive_partner = make_partner(
+            partner_name="Bulk Inactive Partner",
+            email=f"inactive@{self._ns()}.apitest.com",
+            status="Inactive"
+        )
+        with self.assertRaises(frappe.ValidationError):
+            assign_leads_to_partner(lead_names, inactive_partner.name)
+
+    def test_search_partners_api(self):
+        """Test search_partners API function"""
         # Test search by name
         results = search_partners("Alpha")
         self.assertEqual(len(results), 1)
@@ -296,72 +406,38 @@ class TestPartnerAPI(unittest.TestCase):
         self.assertEqual(results[0]["territory"], "North America")
 
         # Test search by email
-        results = search_partners("gamma@apitest.com")
+        results = search_partners(_SEARCH_EMAILS[2])
         self.assertEqual(len(results), 1)
-        self.assertEqual(results[0]["email"], "gamma@apitest.com")
+        self.assertEqual(results[0]["email"], _SEARCH_EMAILS[2])
 
     def test_partner_dashboard_stats_api(self):
         """Test partner_dashboard_stats API function"""
-        from prm.api.partner import partner_dashboard_stats
-
-        # Create test partners with different statuses
-        statuses = ["Active", "Pending Approval", "Inactive"]
-        for i, status in enumerate(statuses):
-            partner = frappe.get_doc({
-                "doctype": "CRM Partner",
-                "partner_name": f"Stats Partner {i+1}",
-                "partner_type": "Reseller",
-                "partner_tier": "Gold",
-                "email": f"stats{i+1}@apitest.com",
-                "status": status
-            })
-            partner.insert()
-
         # Test stats API
-        stats = partner_dashboard_stats()
+        stats = self._stats
         self.assertIn("partners_by_status", stats)
         self.assertIn("top_partners_this_month", stats)
         self.assertIn("onboarding_status", stats)
 
         # Check partners by status
-        status_counts = {item["status"]: item["count"] for item in stats["partners_by_status"]}
-        self.assertGreaterEqual(status_counts.get("Active", 0), 1)
-        self.assertGreaterEqual(status_counts.get("Pending Approval", 0), 1)
+        # One comparison, so a failure reports every missing status at once
+        status_counts = Counter({item["status"]: item["count"] for item in stats["partners_by_status"]})
+        self.assertGreaterEqual(status_counts, Counter({"Active": 1, "Pending Approval": 1}))
 
     def test_calculate_partner_commission_api(self):
         """Test calculate_partner_commission API function"""
-        from prm.api.partner import calculate_partner_commission
-
-        # Create partner with commission rate
-        partner = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "Commission Test Partner",
-            "partner_type": "Reseller",
-            "partner_tier": "Gold",
-            "email": "commission@apitest.com",
-            "commission_rate": 15.0
-        })
-        partner.insert()
+        partner_name = self.shared_partner_by_email[_COMMISSION_EMAILS[0]]
 
         # Test commission calculation
-        commission = calculate_partner_commission(partner.name, 10000)
+        commission = calculate_partner_commission(partner_name, 10000)
         self.assertEqual(commission, 1500.0)
 
         # Test with zero deal value
-        commission_zero = calculate_partner_commission(partner.name, 0)
+        commission_zero = calculate_partner_commission(partner_name, 0)
         self.assertEqual(commission_zero, 0)
 
         # Test partner without commission rate
-        partner_no_rate = frappe.get_doc({
-            "doctype": "CRM Partner",
-            "partner_name": "No Rate Partner",
-            "partner_type": "Reseller",
-            "partner_tier": "Gold",
-            "email": "norate@apitest.com"
-        })
-        partner_no_rate.insert()
-
-        commission_no_rate = calculate_partner_commission(partner_no_rate.name, 10000)
+        partner_no_rate = self.shared_partner_by_email[_COMMISSION_EMAILS[1]]
+        commission_no_rate = calculate_partner_commission(partner_no_rate, 10000)
         self.assertEqual(commission_no_rate, 0)
 
 
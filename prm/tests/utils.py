@@ -0,0 +1,59 @@
+# Copyright (c) 2024, Zinye Technologies and contributors
+# For license information, please see license.txt
+
+from types import MappingProxyType
+
+import frappe
+from frappe.test_runner import make_test_records
+
+TEST_RECORD_DOCTYPES = ("Country", "Territory", "CRM Industry")
+
+# Field values every test partner starts from
+PARTNER_TEMPLATE = MappingProxyType({"partner_type": "Reseller", "partner_tier": "Gold"})
+
+_TEST_RECORDS_LOADED = False
+
+
+def ensure_test_records():
+    """Load the Country, Territory and CRM Industry test records once per test run"""
+    global _TEST_RECORDS_LOADED
+    if _TEST_RECORDS_LOADED:
+        return
+
+    # Skip doctypes the test runner already built records for, e.g. for
+    # another app's tests in the same run
+    loaded = getattr(frappe.local, "test_objects", None) or {}
+    for doctype in TEST_RECORD_DOCTYPES:
+        if doctype not in loaded:
+            make_test_records(doctype)
+    _TEST_RECORDS_LOADED = True
+
+
+def partner_values(**values):
+    """CRM Partner field values: PARTNER_TEMPLATE overridden by `values`"""
+    return {**PARTNER_TEMPLATE, **values}
+
+
+def new_partner(skip_user_creation=True, **values):
+    """
+    Build an unsaved CRM Partner from PARTNER_TEMPLATE and `values`.
+
+    Portal user provisioning is skipped on insert unless a test asks for it.
+    """
+    partner = frappe.new_doc("CRM Partner")
+    partner.update(partner_values(**values))
+    partner.flags.skip_user_creation = skip_user_creation
+    return partner
+
+
+def make_partner(**values):
+    """
+    Write a CRM Partner straight to the database with db_insert.
+
+    Skips validation and controller hooks; for tests that only read the
+    partner back, not ones that exercise validation or onboarding.
+    """
+    partner = new_partner(**values)
+    partner.set_new_name()
+    partner.db_insert()
+    return partner